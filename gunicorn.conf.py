@@ -0,0 +1,30 @@
+# Gunicorn settings for running the bot outside Vercel:
+#   gunicorn main:app
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Webhook handling is I/O bound (Graph API and Upstash calls), so requests are
+# overlapped with threads rather than extra processes. The user state cache and
+# the webhook/admin queues live in-process, so a single worker keeps them
+# coherent; raise WEB_CONCURRENCY only if those are moved out of process.
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+
+# Background worker threads are started at import time, so the app must be
+# loaded in each worker process rather than in the master before forking.
+preload_app = False
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def worker_exit(server, worker):
+    # Finish the webhooks this worker has already acknowledged before it goes
+    # away. The app module is only imported in workers (preload_app is off).
+    app_module = sys.modules.get("main")
+    if app_module is not None:
+        app_module.stop_background_workers()
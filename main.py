@@ -1,15 +1,36 @@
 import os
 import logging
-import requests
-import random
-import string
+import logging.handlers
+import atexit
+import httpx
+import time
+import queue
+import threading
 from datetime import datetime
 from flask import Flask, request, jsonify, render_template
 import json
-import traceback
+import re
+import functools
+import base64
+import secrets
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
 from upstash_redis import Redis
-import redis
+
+# orjson is much faster than the stdlib on the per-message state payloads;
+# fall back to json when it isn't installed. Upstash's REST API takes string
+# values, so encoded payloads are always returned as str.
+try:
+    import orjson
+
+    def dumps_state(data):
+        return orjson.dumps(data).decode()
+
+    loads_state = orjson.loads
+except ImportError:
+    # Match orjson's compact, UTF-8 output so stored payloads stay small
+    dumps_state = functools.partial(json.dumps, separators=(',', ':'), ensure_ascii=False)
+    loads_state = json.loads
 
 app = Flask(__name__)
 
@@ -18,29 +39,91 @@ wa_token = os.environ.get("WA_TOKEN")
 phone_id = os.environ.get("PHONE_ID")
 gen_api = os.environ.get("GEN_API")
 owner_phone = os.environ.get("OWNER_PHONE")
-redis_url = os.environ.get("REDIS_URL")
-AGENT_NUMBERS = ["+263772210415"]
 
-# Redis client setup
+# Shared pool for outbound sends that can run alongside the customer reply
+send_executor = ThreadPoolExecutor(max_workers=8)
+
+# Background worker threads need a long-lived process. On Vercel the function
+# is frozen as soon as the response is sent, so work is done in-request there.
+BACKGROUND_WORKERS = not os.environ.get("VERCEL")
+
+# Redis client setup. Upstash is reached over its REST API; the client keeps a
+# pooled keep-alive HTTP connection, so a failed request is usually a stale
+# pooled socket and is retried quickly rather than after the 3s default.
 redis_client = Redis(
     url=os.environ.get('UPSTASH_REDIS_URL'),
-    token=os.environ.get('UPSTASH_REDIS_TOKEN')
+    token=os.environ.get('UPSTASH_REDIS_TOKEN'),
+    rest_retries=2,
+    rest_retry_interval=0.1
 )
 
+# Graph API client, shared so sends reuse one pooled HTTP/2 connection to
+# graph.facebook.com instead of a fresh TCP+TLS handshake per message. The
+# transport retries failed connection attempts; throttled responses are
+# retried in graph_post.
+graph_client = httpx.Client(
+    headers={
+        'Authorization': f'Bearer {wa_token}',
+        'Content-Type': 'application/json'
+    },
+    # Connecting fails fast so the transport's connect retries fit in the
+    # time a send is allowed to take; reads may still take up to 10s
+    timeout=httpx.Timeout(10.0, connect=3.0),
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+    )
+)
+
+# Close the pooled Redis and Graph connections cleanly when the process exits
+atexit.register(redis_client.close)
+atexit.register(graph_client.close)
+
+@functools.lru_cache(maxsize=4)
+def messages_url(phone_id):
+    """Graph API messages endpoint for a business phone number ID"""
+    return f"https://graph.facebook.com/v19.0/{phone_id}/messages"
+
+# Only statuses where Graph did not accept the message are retried, so a
+# retry can't deliver the same message twice
+GRAPH_RETRY_STATUSES = frozenset([429, 503])
+
+# Graph error codes for a recipient that can't be messaged at all (number not
+# on WhatsApp, or outside the test number's allowed list)
+UNDELIVERABLE_ERROR_CODES = frozenset([131026, 131030])
+
+def graph_error_code(response):
+    """Return the Graph API error code from a failed response, if any"""
+    try:
+        return response.json().get('error', {}).get('code')
+    except ValueError:
+        return None
+
+def graph_post(url, payload, retries=2):
+    """POST an encoded JSON payload to the Graph API, backing off on throttling"""
+    for attempt in range(retries + 1):
+        response = graph_client.post(url, content=payload)
+        if response.status_code not in GRAPH_RETRY_STATUSES or attempt == retries:
+            return response
+        time.sleep(0.2 * 2 ** attempt)
+
 required_vars = ['WA_TOKEN', 'PHONE_ID', 'UPSTASH_REDIS_URL', 'UPSTASH_REDIS_TOKEN']
 missing_vars = [var for var in required_vars if not os.getenv(var)]
 if missing_vars:
     raise RuntimeError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-# Test connection
-try:
-    redis_client.set("foo", "bar")
-    print("✅ Upstash Redis connection successful")
-except Exception as e:
-    print(f"❌ Upstash Redis error: {e}")
-    raise
-    
-logging.basicConfig(level=logging.INFO)
+if BACKGROUND_WORKERS:
+    # Records are handed to a listener thread, so request and worker threads
+    # never wait on stdout. Serverless functions log directly, since a
+    # listener thread would be frozen with anything still queued.
+    log_queue = queue.Queue()
+    logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(log_queue)])
+    log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    log_listener.start()
+    atexit.register(log_listener.stop)
+else:
+    logging.basicConfig(level=logging.INFO)
 
 class MainMenuOptions(Enum):
     ABOUT = "Learn about Contessasoft"
@@ -85,7 +168,72 @@ class ContactOptions(Enum):
     AGENT = "Speak to an agent"
     BACK = "Back to main menu"
 
+# Option labels in display order, built once for the list messages
+MAIN_MENU_VALUES = tuple(option.value for option in MainMenuOptions)
+ABOUT_VALUES = tuple(option.value for option in AboutOptions)
+SERVICE_VALUES = tuple(option.value for option in ServiceOptions)
+SUPPORT_VALUES = tuple(option.value for option in SupportOptions)
+CONTACT_VALUES = tuple(option.value for option in ContactOptions)
+
+# Lowercased labels mapped to their options. List replies arrive as the row
+# title, so they resolve with a single dict lookup; typed replies fall back to
+# substring matching over the same labels. Labels are cut to the 24 characters
+# WhatsApp shows in list rows.
+def option_labels(options):
+    return {option.value.lower()[:24]: option for option in options}
+
+MAIN_MENU_LABELS = option_labels(MainMenuOptions)
+ABOUT_LABELS = option_labels(AboutOptions)
+SERVICE_LABELS = option_labels(ServiceOptions)
+SUPPORT_LABELS = option_labels(SupportOptions)
+CONTACT_LABELS = option_labels(ContactOptions)
+
+# Finds a main menu label inside a longer typed reply in one scan
+MAIN_MENU_LABEL_PATTERN = re.compile('|'.join(map(re.escape, MAIN_MENU_LABELS)))
+
+# List row IDs assigned by build_list_payload for the main menu
+MAIN_MENU_IDS = {f"option_{i}": option for i, option in enumerate(MainMenuOptions, 1)}
+
+YES_REPLIES = frozenset(["yes", "y", "ok", "sure", "yeah", "yep"])
+NO_REPLIES = frozenset(["no", "n", "nope", "nah"])
+RESTART_REPLIES = frozenset(["restart", "start", "menu"])
+# Messages that start over or ask to restart from any step
+GREETINGS = frozenset(["hi", "hello", "hie", "hey", "start"])
+RESTART_COMMANDS = frozenset(["restart", "menu"])
+
+# Reply buttons shared across handlers, built once
+ANYTHING_ELSE_BUTTONS = (
+    {"id": "yes_more", "title": "Yes"},
+    {"id": "no_done", "title": "No"}
+)
+RESTART_BUTTONS = (
+    {"id": "restart_yes", "title": "Yes"},
+    {"id": "restart_no", "title": "No"}
+)
+QUOTE_BUTTONS = (
+    {"id": "quote_btn", "title": "💬 Request Quote"},
+)
+SERVICE_DETAIL_BUTTONS = QUOTE_BUTTONS + (
+    {"id": "back_btn", "title": "🔙 Back to Services"},
+)
+
+def match_option(prompt, labels):
+    """Return the option for a reply: an exact label first, else the first
+    label containing the prompt, ignoring case"""
+    choice = prompt.lower()
+    option = labels.get(choice)
+    if option is None:
+        for label, candidate in labels.items():
+            if choice in label:
+                return candidate
+    return option
+
 class User:
+    __slots__ = (
+        'name', 'phone', 'email', 'service_type', 'project_description',
+        'callback_requested', 'support_type'
+    )
+
     def __init__(self, name, phone):
         self.name = name
         self.phone = phone
@@ -96,36 +244,32 @@ class User:
         self.support_type = None
 
     def to_dict(self):
-        return {
-            "name": self.name,
-            "phone": self.phone,
-            "email": self.email,
-            "service_type": self.service_type.value if self.service_type else None,
-            "project_description": self.project_description,
-            "callback_requested": self.callback_requested,
-            "support_type": self.support_type.value if self.support_type else None
-        }
-
-    @classmethod
-    def from_dict(cls, data):
-        user = cls(data["name"], data["phone"])
-        user.email = data.get("email")
-        if data.get("service_type"):
-            user.service_type = ServiceOptions(data["service_type"])
-        user.project_description = data.get("project_description")
-        user.callback_requested = data.get("callback_requested", False)
-        if data.get("support_type"):
-            user.support_type = SupportOptions(data["support_type"])
-        return user
+        """Serialize the user, leaving out fields that have not been collected yet"""
+        data = {"name": self.name, "phone": self.phone}
+        if self.email is not None:
+            data["email"] = self.email
+        if self.service_type:
+            data["service_type"] = self.service_type.value
+        if self.project_description is not None:
+            data["project_description"] = self.project_description
+        if self.callback_requested:
+            data["callback_requested"] = True
+        if self.support_type:
+            data["support_type"] = self.support_type.value
+        return data
 
 # Phone number normalization function
+NON_PHONE_CHARS = re.compile(r'[^\d+]')
+
+# Memoized: the same few senders write repeatedly within a conversation
+@functools.lru_cache(maxsize=4096)
 def normalize_phone_number(phone):
     """Normalize phone number to handle different formats"""
     if not phone:
         return phone
     
     # Remove any non-digit characters except +
-    cleaned = ''.join(c for c in phone if c.isdigit() or c == '+')
+    cleaned = NON_PHONE_CHARS.sub('', phone)
     
     # Handle Zimbabwe numbers
     if cleaned.startswith('+263'):
@@ -137,106 +281,210 @@ def normalize_phone_number(phone):
     else:
         return cleaned
 
+# Agents' numbers, normalized once so a sender needs a single set lookup
+AGENT_NUMBERS = frozenset(map(normalize_phone_number, ["+263772210415"]))
+
+# In-process cache of recently saved user states. Users often send the next
+# message within seconds, so a worker that just saved a state can serve the
+# following read without a Redis round trip. Redis stays authoritative: every
+# save writes through. States are cached serialized so callers never share a
+# dict. The cache is only used with background workers, where the sharded
+# webhook queues make this process the only one handling a given sender;
+# serverless instances run side by side and would serve each other's stale
+# states, so they always read Redis.
+STATE_CACHE_ENABLED = BACKGROUND_WORKERS
+STATE_CACHE_TTL = 5.0
+_state_cache = {}
+_state_cache_writes = 0
+# When each session key's TTL was last refreshed by this process, as a
+# monotonic deadline, so unchanged updates can skip the write
+_state_expires_at = {}
+
+def cache_user_state(normalized_phone, state_json):
+    global _state_cache_writes
+    if not STATE_CACHE_ENABLED:
+        return
+    now = time.monotonic()
+    _state_cache[normalized_phone] = (now, state_json)
+    _state_cache_writes += 1
+    if _state_cache_writes % 256 == 0:
+        for phone, (saved_at, _) in list(_state_cache.items()):
+            if now - saved_at >= STATE_CACHE_TTL:
+                _state_cache.pop(phone, None)
+        for phone, expires_at in list(_state_expires_at.items()):
+            if expires_at <= now:
+                _state_expires_at.pop(phone, None)
+
 # User state functions (for bot flow state)
+# State is stored as a Redis hash with one JSON-encoded value per top-level
+# field, so a step transition only writes the fields that changed instead of
+# re-sending the whole state.
 def get_user_state(phone_number):
     normalized_phone = normalize_phone_number(phone_number)
-    state_json = redis_client.get(f"user_state:{normalized_phone}")
-    if state_json:
-        state = json.loads(state_json)
-        print(f"✅ Retrieved user state for {normalized_phone}: {state}")
+    if STATE_CACHE_ENABLED:
+        cached = _state_cache.get(normalized_phone)
+        if cached and time.monotonic() - cached[0] < STATE_CACHE_TTL:
+            return loads_state(cached[1])
+    
+    fields = redis_client.hgetall(f"user_session:{normalized_phone}")
+    if fields:
+        state = {field: loads_state(value) for field, value in fields.items()}
+        cache_user_state(normalized_phone, dumps_state(state))
+        logging.debug("✅ Retrieved user state for %s: %s", normalized_phone, state)
         return state
     default_state = {'step': 'welcome', 'sender': normalized_phone}
-    print(f"❌ No user state found for {normalized_phone}, returning default: {default_state}")
+    # Cache the miss too, so a new user's replies in this turn don't each
+    # go back to Redis to find there is still no state
+    cache_user_state(normalized_phone, dumps_state(default_state))
+    logging.debug("No user state found for %s, using default", normalized_phone)
     return default_state
 
-def update_user_state(phone_number, updates):
+# Menu navigation is over in minutes, so idle sessions expire after 30 minutes.
+# Steps that wait for the user to type in details keep a day, since people
+# often step away to find them.
+STATE_TTL = 1800
+DETAILS_STATE_TTL = 86400
+DETAILS_STEPS = frozenset(['get_quote_info', 'get_support_details', 'get_callback_details'])
+# With background workers, an update that changes nothing still refreshes the
+# TTL once less than this many seconds are left on it
+STATE_TTL_REFRESH_MARGIN = 300
+
+def update_user_state(phone_number, updates, current=None, replace=False):
+    """Merge updates into the user's state and save it.
+
+    Only the updated fields are written. message_handler already holds the
+    state loaded for this message; passing it as `current` merges into it in
+    place instead of reading it back. Without it, the merged state is read
+    back in the same pipeline. With `replace`, fields that are not in
+    `current` or `updates` are dropped, e.g. when a greeting starts over.
+    Moving back to 'welcome' ends the conversation and deletes the state.
+    With background workers this process is the only one handling the
+    sender, so only fields that differ from `current` are written, and an
+    update that changes nothing is skipped while the key's TTL still has more
+    than STATE_TTL_REFRESH_MARGIN seconds left. Serverless instances cannot
+    trust `current` to be the latest state, so they always write every
+    updated field and refresh the TTL.
+    """
     normalized_phone = normalize_phone_number(phone_number)
-    print(f"🔄 Updating user state for {normalized_phone}")
+    key = f"user_session:{normalized_phone}"
     
-    current = get_user_state(normalized_phone)
-    current.update(updates)
-    current['phone_number'] = normalized_phone
-    if 'sender' not in current:
-        current['sender'] = normalized_phone
-        
-    key = f"user_state:{normalized_phone}"
-    print(f"💾 Saving user state to Redis key: {key}")
-    print(f"📦 User state data: {current}")
+    step = updates.get('step') or (current or {}).get('step')
+    if updates.get('step') == 'welcome' and not replace:
+        # A missing state already reads back as 'welcome'
+        try:
+            redis_client.delete(key)
+            _state_expires_at.pop(normalized_phone, None)
+            state = {'step': 'welcome', 'sender': normalized_phone}
+            cache_user_state(normalized_phone, dumps_state(state))
+            logging.debug("✅ User state cleared for %s", normalized_phone)
+            return state
+        except Exception as e:
+            logging.error("❌ Redis error clearing user state for %s: %s", normalized_phone, e)
+            return None
     
+    if replace:
+        updates = {**(current or {}), **updates}
+    # The identity fields are written when the hash is created; a state loaded
+    # from Redis already has them, so a step transition sends only its changes
+    new_hash = replace or current is None or current.get('phone_number') != normalized_phone
+    if new_hash or not STATE_CACHE_ENABLED:
+        fields = {field: dumps_state(value) for field, value in updates.items()}
+        if new_hash:
+            fields['phone_number'] = dumps_state(normalized_phone)
+    else:
+        fields = {
+            field: dumps_state(value) for field, value in updates.items()
+            if field not in current or current[field] != value
+        }
+    ttl = DETAILS_STATE_TTL if step in DETAILS_STEPS else STATE_TTL
+    now = time.monotonic()
+    if (STATE_CACHE_ENABLED and not fields
+            and _state_expires_at.get(normalized_phone, 0) - now > STATE_TTL_REFRESH_MARGIN):
+        logging.debug("💾 User state %s unchanged, skipping write", key)
+        return current
     try:
-        result = redis_client.setex(key, 86400, json.dumps(current))
-        print(f"✅ User state save result: {result}")
-        
-        # Immediate verification
-        verify = redis_client.get(key)
-        if verify:
-            verified_data = json.loads(verify)
-            print(f"✅ Verified user state save successful: {verified_data.get('step', 'unknown')}")
+        pipeline = redis_client.pipeline()
+        if replace:
+            pipeline.delete(key)
+        if fields:
+            pipeline.hset(key, values=fields)
+        if new_hash:
+            pipeline.hsetnx(key, 'sender', dumps_state(normalized_phone))
+        pipeline.expire(key, ttl)
+        if current is None:
+            pipeline.hgetall(key)
+            results = pipeline.exec()
+            state = {field: loads_state(value) for field, value in results[-1].items()}
         else:
-            print(f"❌ User state verification failed - key not found")
-            
+            pipeline.exec()
+            state = current
+            state.update(updates)
+            state['phone_number'] = normalized_phone
+            state.setdefault('sender', normalized_phone)
+        if STATE_CACHE_ENABLED:
+            _state_expires_at[normalized_phone] = now + ttl
+        cache_user_state(normalized_phone, dumps_state(state))
+        logging.debug("💾 Saved user state %s: %s", key, updates)
+        return state
     except Exception as e:
-        print(f"❌ Redis error saving user state: {e}")
+        logging.error("❌ Redis error saving user state for %s: %s", normalized_phone, e)
 
 # Conversation history functions (for message history)
-def save_conversation_message(phone_number, message, is_user=True):
+CONVERSATION_LIMIT = 100
+
+def save_conversation_message(phone_number, message, is_user=True, step=None):
     """Save a message to conversation history (max 100 messages)"""
     normalized_phone = normalize_phone_number(phone_number)
-    conversation_key = f"conversation:{normalized_phone}"
+    conversation_key = f"conversation_log:{normalized_phone}"
     
     try:
-        # Get existing conversation
-        conversation_json = redis_client.get(conversation_key)
-        if conversation_json:
-            conversation = json.loads(conversation_json)
-        else:
-            conversation = []
-        
         # Create message object
         message_obj = {
             'timestamp': datetime.now().isoformat(),
             'is_user': is_user,
             'message': message,
-            'step': get_user_state(normalized_phone).get('step', 'unknown')
+            'step': step or get_user_state(normalized_phone).get('step', 'unknown')
         }
         
-        # Add to conversation
-        conversation.append(message_obj)
-        
-        # Keep only last 100 messages
-        if len(conversation) > 100:
-            conversation = conversation[-100:]
-        
-        # Save back to Redis
-        redis_client.setex(conversation_key, 86400, json.dumps(conversation))
-        print(f"💾 Saved conversation message for {normalized_phone}, total messages: {len(conversation)}")
+        # Append, trim to the last 100 and refresh the TTL in one round trip,
+        # so the history never has to be read back before writing
+        pipeline = redis_client.pipeline()
+        pipeline.rpush(conversation_key, dumps_state(message_obj))
+        pipeline.ltrim(conversation_key, -CONVERSATION_LIMIT, -1)
+        pipeline.expire(conversation_key, 86400)
+        total = pipeline.exec()[0]
+        logging.debug("💾 Saved conversation message for %s, total messages: %d", normalized_phone, min(total, CONVERSATION_LIMIT))
         
     except Exception as e:
-        print(f"❌ Error saving conversation message: {e}")
+        logging.error("❌ Error saving conversation message: %s", e)
 
 def get_conversation_history(phone_number, limit=100):
     """Get conversation history for a user"""
     normalized_phone = normalize_phone_number(phone_number)
-    conversation_key = f"conversation:{normalized_phone}"
+    conversation_key = f"conversation_log:{normalized_phone}"
     
     try:
-        conversation_json = redis_client.get(conversation_key)
-        if conversation_json:
-            conversation = json.loads(conversation_json)
-            return conversation[-limit:] if limit else conversation
-        return []
+        messages = redis_client.lrange(conversation_key, -limit if limit else 0, -1)
+        return [loads_state(message) for message in messages]
     except Exception as e:
-        print(f"❌ Error getting conversation history: {e}")
+        logging.error("❌ Error getting conversation history: %s", e)
         return []
 
 def get_full_conversation_history(phone_number):
     """Get full conversation history (all 100 messages)"""
-    return get_conversation_history(phone_number, limit=100)
+    return get_conversation_history(phone_number, limit=CONVERSATION_LIMIT)
+
+# Reference ID functions
+def generate_reference(length=6):
+    """Generate a reference ID for support and callback requests (e.g., 7QK2ZD)"""
+    # Each base32 character (A-Z, 2-7) carries 5 bits, so read just enough
+    # random bytes for the requested length
+    return base64.b32encode(secrets.token_bytes((length * 5 + 7) // 8)).decode('ascii')[:length]
 
 # Quote request functions
 def generate_quote_reference():
-    """Generate a unique quote reference (e.g., 3CPHLV59)"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+    """Generate a unique quote reference (e.g., 3CPHLV5Q)"""
+    return generate_reference(8)
 
 def save_quote_request(quote_reference, quote_data):
     """Save quote request to Redis with quote reference as key"""
@@ -248,12 +496,12 @@ def save_quote_request(quote_reference, quote_data):
         quote_data['quote_reference'] = quote_reference
         
         # Save to Redis with longer expiration (30 days for quotes)
-        result = redis_client.setex(quote_key, 2592000, json.dumps(quote_data))
-        print(f"💾 Saved quote request to Redis key: {quote_key}")
-        print(f"📦 Quote data: {quote_data}")
+        result = redis_client.setex(quote_key, 2592000, dumps_state(quote_data))
+        logging.info("💾 Saved quote request to Redis key: %s", quote_key)
+        logging.debug("📦 Quote data: %s", quote_data)
         return result
     except Exception as e:
-        print(f"❌ Error saving quote request: {e}")
+        logging.error("❌ Error saving quote request: %s", e)
         return False
 
 def get_quote_request(quote_reference):
@@ -263,102 +511,107 @@ def get_quote_request(quote_reference):
     try:
         quote_json = redis_client.get(quote_key)
         if quote_json:
-            quote_data = json.loads(quote_json)
-            print(f"✅ Retrieved quote request: {quote_reference}")
+            quote_data = loads_state(quote_json)
+            logging.debug("✅ Retrieved quote request: %s", quote_reference)
             return quote_data
-        print(f"❌ Quote request not found: {quote_reference}")
+        logging.info("❌ Quote request not found: %s", quote_reference)
         return None
     except Exception as e:
-        print(f"❌ Error getting quote request: {e}")
+        logging.error("❌ Error getting quote request: %s", e)
         return None
 
+def scan_keys(pattern, count=100):
+    """Collect the keys matching pattern with SCAN, which walks the keyspace
+    in pages instead of blocking Redis the way KEYS does"""
+    keys = []
+    cursor = 0
+    while True:
+        cursor, page = redis_client.scan(cursor, match=pattern, count=count)
+        keys.extend(page)
+        if cursor == 0:
+            return keys
+
 def get_all_quote_requests():
     """Get all quote requests (admin function)"""
     try:
         # Note: This might be inefficient for large datasets
         # In production, you might want to use Redis search or a separate database
-        keys = redis_client.keys("quote:*")
+        keys = scan_keys("quote:*")
         quotes = []
-        for key in keys:
-            quote_json = redis_client.get(key)
-            if quote_json:
-                quote_data = json.loads(quote_json)
-                quotes.append(quote_data)
+        if keys:
+            for quote_json in redis_client.mget(*keys):
+                if quote_json:
+                    quote_data = loads_state(quote_json)
+                    quotes.append(quote_data)
         
         # Sort by timestamp (newest first)
         quotes.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
         return quotes
     except Exception as e:
-        print(f"❌ Error getting all quote requests: {e}")
+        logging.error("❌ Error getting all quote requests: %s", e)
         return []
 
+def split_message(text, limit=3000):
+    """Split text into parts of at most `limit` characters, breaking at the
+    last line break or space before the limit so words and emoji sequences
+    stay whole; the separator a part is cut at is dropped."""
+    parts = []
+    start = 0
+    while len(text) - start > limit:
+        end = start + limit
+        cut = text.rfind('\n', start, end)
+        if cut <= start:
+            cut = text.rfind(' ', start, end)
+        if cut <= start:
+            # No break to cut at, so cut hard at the limit
+            parts.append(text[start:end])
+            start = end
+        else:
+            parts.append(text[start:cut])
+            start = cut + 1
+    parts.append(text[start:])
+    return parts
+
 def send_message(text, recipient, phone_id):
-    url = f"https://graph.facebook.com/v19.0/{phone_id}/messages"
-    headers = {
-        'Authorization': f'Bearer {wa_token}',
-        'Content-Type': 'application/json'
-    }
-    
-    if len(text) > 3000:
-        parts = [text[i:i+3000] for i in range(0, len(text), 3000)]
-        for part in parts:
-            data = {
-                "messaging_product": "whatsapp",
-                "to": recipient,
-                "type": "text",
-                "text": {"body": part}
-            }
-            try:
-                requests.post(url, headers=headers, json=data)
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Failed to send message: {e}")
-        return
+    url = messages_url(phone_id)
     
+    # WhatsApp caps text bodies, so long messages go out as consecutive parts.
+    # Parts are sent in order so the recipient reads them in sequence.
+    body = {}
     data = {
         "messaging_product": "whatsapp",
         "to": recipient,
         "type": "text",
-        "text": {"body": text}
+        "text": body
     }
     try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        print(f"✅ Message sent to {recipient}")
+        for part in split_message(text):
+            body["body"] = part
+            response = graph_post(url, dumps_state(data))
+            response.raise_for_status()
+        logging.debug("✅ Message sent to %s", recipient)
         
         # Save bot response to conversation history
         save_conversation_message(recipient, text, is_user=False)
         
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to send message: {e}")
+    except httpx.HTTPError as e:
+        logging.error("Failed to send message: %s", e)
 
-def send_button_message(text, buttons, recipient, phone_id):
-    url = f"https://graph.facebook.com/v19.0/{phone_id}/messages"
-    headers = {
-        'Authorization': f'Bearer {wa_token}',
-        'Content-Type': 'application/json'
-    }
-    
-    # Validate recipient phone number
-    if not recipient or not recipient.strip():
-        print(f"Invalid recipient: {recipient}")
-        return False
-    
-    # Ensure recipient is in international format
-    original_recipient = recipient
-    if recipient.startswith('0'):
-        recipient = '+263' + recipient[1:]
-    elif not recipient.startswith('+'):
-        recipient = '+' + recipient
-    
-    print(f"Original recipient: {original_recipient}")
-    print(f"Normalized recipient: {recipient}")
-    
+# Null bytes are dropped and carriage returns become newlines
+BODY_TEXT_FIXES = str.maketrans({'\x00': None, '\r': '\n'})
+
+@functools.lru_cache(maxsize=64)
+def build_button_payload(text, buttons):
+    """Serialize a button message for a body text and (id, title) pairs.
+
+    Menu prompts and service details repeat across users, so each distinct
+    message is built once with a placeholder for the recipient, which
+    send_button_message fills in per send. Returns the payload, or None when
+    there are no buttons, along with the cleaned body text.
+    """
     # WhatsApp button message format
     button_items = []
-    for i, button in enumerate(buttons[:3]):  # WhatsApp allows max 3 buttons
-        button_id = button.get("id", f"button_{i+1}")
-        button_title = button.get("title", "Button")
-        
+    for i, (button_id, button_title) in enumerate(buttons):
         # Ensure button title is within WhatsApp limits
         if len(button_title) > 20:
             button_title = button_title[:17] + "..."
@@ -374,32 +627,25 @@ def send_button_message(text, buttons, recipient, phone_id):
                 "title": button_title
             }
         })
-        
-        print(f"Button {i+1}: id='{button_id}', title='{button_title}'")
     
     if not button_items:
-        print("No valid buttons found, falling back to text message")
-        fallback_text = f"{text}\n\n" + "\n".join(f"- {btn.get('title', 'Option')}" for btn in buttons[:3])
-        send_message(fallback_text, recipient, phone_id)
-        return False
+        return None, text
     
     # Ensure text is within WhatsApp limits and clean it
     if len(text) > 1024:
         text = text[:1021] + "..."
     
     # Clean text of any problematic characters
-    text = text.replace('\x00', '').replace('\r', '\n').strip()
+    text = text.translate(BODY_TEXT_FIXES).strip()
     
     # Ensure text is not empty
     if not text:
         text = "New message"
     
-    print(f"Final text to send: '{text}' (length: {len(text)})")
-    
     data = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
-        "to": recipient,
+        "to": "__TO__",
         "type": "interactive",
         "interactive": {
             "type": "button",
@@ -411,51 +657,80 @@ def send_button_message(text, buttons, recipient, phone_id):
             }
         }
     }
+    return dumps_state(data), text
+
+def button_fallback_text(text, buttons):
+    """Plain-text version of a button message, listing the button titles"""
+    return f"{text}\n\n" + "\n".join(f"- {btn.get('title', 'Option')}" for btn in buttons[:3])
+
+def send_button_message(text, buttons, recipient, phone_id):
+    url = messages_url(phone_id)
+    
+    # Validate recipient phone number
+    if not recipient or not recipient.strip():
+        logging.error("Invalid recipient: %r", recipient)
+        return False
+    
+    # Ensure recipient is in international format
+    if recipient.startswith('0'):
+        recipient = '+263' + recipient[1:]
+    elif not recipient.startswith('+'):
+        recipient = '+' + recipient
+    
+    payload, text = build_button_payload(
+        text,
+        tuple((button.get("id"), button.get("title", "Button")) for button in buttons[:3])  # WhatsApp allows max 3 buttons
+    )
+    
+    if payload is None:
+        logging.warning("No valid buttons found, falling back to text message")
+        send_message(button_fallback_text(text, buttons), recipient, phone_id)
+        return False
     
-    print(f"Final data to send: {json.dumps(data, indent=2)}")
+    payload = payload.replace('"__TO__"', dumps_state(recipient), 1)
     
     try:
-        print(f"Sending button message to {recipient}")
-        response = requests.post(url, headers=headers, json=data)
+        response = graph_post(url, payload)
         response.raise_for_status()
-        print(f"✅ Button message sent successfully to {recipient}")
+        logging.debug("✅ Button message sent to %s: %s", recipient, payload)
         
         # Save bot response to conversation history
         save_conversation_message(recipient, text, is_user=False)
         
         return True
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to send button message: {e}")
-        print(f"Button message failed: {e}")
+    except httpx.HTTPError as e:
         if hasattr(e, 'response') and e.response is not None:
-            print(f"Response status: {e.response.status_code}")
-            print(f"Response text: {e.response.text}")
+            logging.error("Failed to send button message to %s: %s %s", recipient, e.response.status_code, e.response.text)
+            if graph_error_code(e.response) in UNDELIVERABLE_ERROR_CODES:
+                # A text fallback to the same number would fail the same way
+                return False
+        else:
+            logging.error("Failed to send button message to %s: %s", recipient, e)
         
         # Fallback to simple text message
-        fallback_text = f"{text}\n\n" + "\n".join(f"- {btn.get('title', 'Option')}" for btn in buttons[:3])
-        send_message(fallback_text, recipient, phone_id)
+        send_message(button_fallback_text(text, buttons), recipient, phone_id)
         return False
 
-def send_list_message(text, options, recipient, phone_id):
-    url = f"https://graph.facebook.com/v19.0/{phone_id}/messages"
-    headers = {
-        'Authorization': f'Bearer {wa_token}',
-        'Content-Type': 'application/json'
-    }
-    
+@functools.lru_cache(maxsize=32)
+def build_list_payload(options):
+    """Serialize the list message for a tuple of option labels.
+
+    The menus are static, so the JSON is built once per menu with placeholders
+    for the recipient and body text, which send_list_message fills in per send.
+    """
     # Validate and prepare the list items
     formatted_rows = []
     for i, option in enumerate(options[:10]):  # WhatsApp allows max 10 items
         formatted_rows.append({
             "id": f"option_{i+1}",
             "title": option[:24],  # Max 24 characters for title
-            "description": option[24:72] if len(option) > 24 else ""  # Optional description
+            "description": option[24:72]  # Optional description, empty for short labels
         })
     
     payload = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
-        "to": recipient,
+        "to": "__TO__",
         "type": "interactive",
         "interactive": {
             "type": "list",
@@ -464,7 +739,7 @@ def send_list_message(text, options, recipient, phone_id):
                 "text": ""[:60]  # Max 60 chars for header
             },
             "body": {
-                "text": text[:1024]  # Max 1024 chars for body
+                "text": "__TEXT__"  # Max 1024 chars, truncated when filled in
             },
             "footer": {
                 "text": ""[:60]  # Max 60 chars for footer
@@ -480,199 +755,388 @@ def send_list_message(text, options, recipient, phone_id):
             }
         }
     }
+    return dumps_state(payload)
+
+def send_list_message(text, options, recipient, phone_id):
+    url = messages_url(phone_id)
+    
+    # Recipient first: once the body text is spliced in, an escaped "__TO__"
+    # inside it can never match the quoted placeholder
+    payload = (
+        build_list_payload(tuple(options))
+        .replace('"__TO__"', dumps_state(recipient), 1)
+        .replace('"__TEXT__"', dumps_state(text[:1024]), 1)
+    )
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = graph_post(url, payload)
         response.raise_for_status()
-        logging.info(f"✅ List message sent successfully to {recipient}")
+        logging.info("✅ List message sent successfully to %s", recipient)
         
         # Save bot response to conversation history
         save_conversation_message(recipient, text, is_user=False)
         
         return True
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         error_detail = f"Status: {e.response.status_code}, Response: {e.response.text}"
-        logging.error(f"Failed to send list message: {error_detail}")
+        logging.error("Failed to send list message: %s", error_detail)
         # Fallback to simple message if list fails
         fallback_msg = f"{text}\n\n" + "\n".join(f"{i+1}. {opt}" for i, opt in enumerate(options[:10]))
         send_message(fallback_msg, recipient, phone_id)
         return False
     except Exception as e:
-        logging.error(f"Unexpected error sending list message: {str(e)}")
+        logging.error("Unexpected error sending list message: %s", e)
         return False
 
+class TokenBucket:
+    """Blocking token-bucket rate limiter"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+# Owner notifications are queued and drained by a worker thread, rate limited
+# well under the Cloud API throughput limit so bursts don't trigger 429s.
+# The worker collects whatever arrives within a short window and sends the
+# batch concurrently over the shared HTTP/2 connection.
+admin_queue = queue.Queue(maxsize=10000)
+admin_rate_limiter = TokenBucket(rate=50, capacity=100)
+ADMIN_BATCH_SIZE = 50
+ADMIN_BATCH_WINDOW = 0.05
+# Put on a worker queue to make its thread exit once everything queued before
+# it has been handled
+STOP_WORKER = None
+
+def next_admin_batch():
+    batch = [admin_queue.get()]
+    deadline = time.monotonic() + ADMIN_BATCH_WINDOW
+    while len(batch) < ADMIN_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(admin_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def admin_notify_worker():
+    while True:
+        batch = next_admin_batch()
+        futures = []
+        for item in batch:
+            if item is STOP_WORKER:
+                continue
+            admin_rate_limiter.consume()
+            try:
+                futures.append(send_executor.submit(send_message, *item))
+            except RuntimeError:
+                # The executor takes no new work once the interpreter is
+                # exiting, so the remaining notifications are sent inline
+                try:
+                    send_message(*item)
+                except Exception:
+                    logging.exception("Error sending admin notification")
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                logging.exception("Error sending admin notification")
+        for _ in batch:
+            admin_queue.task_done()
+        if STOP_WORKER in batch:
+            return
+
+admin_thread = None
+if BACKGROUND_WORKERS:
+    admin_thread = threading.Thread(target=admin_notify_worker, daemon=True, name="admin-notify")
+    admin_thread.start()
+
+def notify_staff(text, recipient, phone_id):
+    """Send a notification to staff without holding up the customer reply.
+
+    With background workers the message is queued and None is returned. Otherwise
+    the send is started on the executor and its future returned, so the caller can
+    send the customer reply meanwhile and wait on both before the request ends.
+    """
+    if BACKGROUND_WORKERS:
+        try:
+            admin_queue.put_nowait((text, recipient, phone_id))
+            return None
+        except queue.Full:
+            logging.error("Admin notification queue is full, sending inline")
+    return send_executor.submit(send_message, text, recipient, phone_id)
+
+# Staff notification messages, filled in with str.format_map
+QUOTE_REQUEST_TEMPLATE = (
+    "📋 *New Quote Request* - {reference}\n\n"
+    "👤 Name: {name}\n"
+    "📞 Phone: {phone}\n"
+    "📧 Email: {email}\n"
+    "🛠️ Service: {service}\n"
+    "📝 Description: {description}\n"
+    "⏰ Submitted: {submitted}"
+)
+SUPPORT_REQUEST_TEMPLATE = (
+    "🆘 *New Support Request*\n\n"
+    "👤 From: {name} - {phone}\n"
+    "🔧 Type: {support_type}\n"
+    "📝 Details: {details}"
+)
+CALLBACK_REQUEST_TEMPLATE = (
+    "📞 *Callback Request*\n\n"
+    "📞 From: {phone}\n"
+    "📝 Details: {details}"
+)
+
+def notify_owner(text, phone_id):
+    """Notify the business owner, see notify_staff"""
+    if not owner_phone:
+        return None
+    return notify_staff(text, owner_phone, phone_id)
+
+def safe_handler(error_message="An error occurred. Please try again.", fallback_step='welcome'):
+    """Wrap a step handler so an unexpected error is logged, the user is told,
+    and the conversation moves to fallback_step instead of getting stuck."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(prompt, user_data, phone_id):
+            try:
+                return handler(prompt, user_data, phone_id)
+            except Exception:
+                logging.exception("Error in %s", handler.__name__)
+                send_message(error_message, user_data['sender'], phone_id)
+                return {'step': fallback_step}
+        return wrapper
+    return decorator
+
 # New function to ask if user needs anything else
+@safe_handler("An error occurred. Returning to main menu.")
 def handle_anything_else(prompt, user_data, phone_id):
     """Ask if user needs anything else after completing a flow"""
-    try:
-        text = (prompt or "").strip().lower()
-
-        # Initial entry - ask if anything else is needed
-        if text == "":
-            send_button_message(
-                "Is there anything else I can help you with?",
-                [
-                    {"id": "yes_more", "title": "Yes"},
-                    {"id": "no_done", "title": "No"}
-                ],
-                user_data['sender'],
-                phone_id
-            )
-            update_user_state(user_data['sender'], {'step': 'anything_else'})
-            return {'step': 'anything_else'}
-
-        # Positive response - show main menu with different message
-        if text in ["yes", "y", "yes_more", "ok", "sure", "yeah", "yep"]:
-            menu_msg = "Please select an option:"
-            menu_options = [option.value for option in MainMenuOptions]
-            send_list_message(menu_msg, menu_options, user_data['sender'], phone_id)
-            update_user_state(user_data['sender'], {'step': 'main_menu'})
-            return {'step': 'main_menu'}
-
-        # Negative response - end conversation
-        if text in ["no", "n", "no_done", "nope", "nah"]:
-            send_message("Have a good day! 😊", user_data['sender'], phone_id)
-            update_user_state(user_data['sender'], {'step': 'welcome'})
-            return {'step': 'welcome'}
-
-        # Any other input - re-send buttons
+    text = (prompt or "").strip().lower()
+
+    # Initial entry - ask if anything else is needed
+    if text == "":
         send_button_message(
-            "Please confirm: is there anything else I can help you with?",
-            [
-                {"id": "yes_more", "title": "Yes"},
-                {"id": "no_done", "title": "No"}
-            ],
+            "Is there anything else I can help you with?",
+            ANYTHING_ELSE_BUTTONS,
             user_data['sender'],
             phone_id
         )
         return {'step': 'anything_else'}
 
-    except Exception as e:
-        logging.error(f"Error in handle_anything_else: {e}")
-        send_message("An error occurred. Returning to main menu.", user_data['sender'], phone_id)
+    # Positive response - show main menu with different message
+    if text in YES_REPLIES or text == "yes_more":
+        menu_msg = "Please select an option:"
+        menu_options = MAIN_MENU_VALUES
+        send_list_message(menu_msg, menu_options, user_data['sender'], phone_id)
+        return {'step': 'main_menu'}
+
+    # Negative response - end conversation
+    if text in NO_REPLIES or text == "no_done":
+        send_message("Have a good day! 😊", user_data['sender'], phone_id)
         return {'step': 'welcome'}
 
+    # Any other input - re-send buttons
+    send_button_message(
+        "Please confirm: is there anything else I can help you with?",
+        ANYTHING_ELSE_BUTTONS,
+        user_data['sender'],
+        phone_id
+    )
+    return {'step': 'anything_else'}
+
+# Main menu choices: the list message to show, its options, and the next state
+MAIN_MENU_RESPONSES = {
+    MainMenuOptions.ABOUT: (
+        "Contessasoft is a Zimbabwe-based software company established in 2022.\n"
+        "We develop custom systems for businesses in finance, education, logistics, retail, and other sectors.\n\n"
+        "Would you like to:",
+        ABOUT_VALUES,
+        {'step': 'about_menu'}
+    ),
+    MainMenuOptions.SERVICES: (
+        "🔧 *Our Services* 🔧\n\n"
+        "We offer complete digital solutions:\n"
+        "Select a service to learn more:",
+        SERVICE_VALUES,
+        {'step': 'services_menu', 'quote_flow': False}
+    ),
+    # Show services menu with quote-specific message
+    MainMenuOptions.QUOTE: (
+        "📋 *Request a Quote* 📋\n\n"
+        "Please select the service you would like a quotation for:",
+        SERVICE_VALUES,
+        {'step': 'services_menu', 'quote_flow': True}  # Flag to indicate this is for quote
+    ),
+    MainMenuOptions.SUPPORT: (
+        "Please select the type of support you need:",
+        SUPPORT_VALUES,
+        {'step': 'support_menu'}
+    ),
+    MainMenuOptions.CONTACT: (
+        "You can reach Contessasoft through the following:\n\n"
+        "📍 Address: 115 ED Mnangagwa Road, Highlands, Harare, Zimbabwe\n"
+        "📞 WhatsApp: +263 242 498954\n"
+        "✉️ Email: sales@contessasoft.co.zw\n\n"
+        "Would you like to:",
+        CONTACT_VALUES,
+        {'step': 'contact_menu'}
+    )
+}
+
 # Updated handle_main_menu to show services when quote is selected
+@safe_handler()
 def handle_main_menu(prompt, user_data, phone_id):
-    try:
-        # Normalize input
-        normalized = prompt.strip().lower()
-        print(f"🧭 handle_main_menu() received prompt: '{prompt}' (normalized: '{normalized}')")
-
-        # Map list reply IDs to menu options (IDs come from send_list_message)
-        option_map = {
-            "option_1": MainMenuOptions.ABOUT,
-            "option_2": MainMenuOptions.SERVICES,
-            "option_3": MainMenuOptions.QUOTE,
-            "option_4": MainMenuOptions.SUPPORT,
-            "option_5": MainMenuOptions.CONTACT
-        }
-
-        # Try to match by list ID first
-        selected_option = option_map.get(normalized)
-
-        # If not found, try to match by text (handles typed replies or button titles)
-        if not selected_option:
-            for option in MainMenuOptions:
-                opt_text = option.value.lower()[:24]  # WhatsApp truncates to 24 chars
-                if normalized in opt_text or opt_text in normalized:
-                    selected_option = option
-                    break
-
-        # If still not matched, re-prompt user
-        if not selected_option:
-            print(f"⚠️ No valid match for '{prompt}', staying in main_menu")
-            send_message("Please select a valid option from the list.", user_data['sender'], phone_id)
-            return {'step': 'main_menu'}
-
-        print(f"✅ Selected option: {selected_option.name}")
-
-        # --- Handle the selected option ---
-        if selected_option == MainMenuOptions.ABOUT:
-            about_msg = (
-                "Contessasoft is a Zimbabwe-based software company established in 2022.\n"
-                "We develop custom systems for businesses in finance, education, logistics, retail, and other sectors.\n\n"
-                "Would you like to:"
-            )
-            about_options = [option.value for option in AboutOptions]
-            send_list_message(about_msg, about_options, user_data['sender'], phone_id)
-            update_user_state(user_data['sender'], {'step': 'about_menu'})
-            return {'step': 'about_menu'}
-
-        elif selected_option == MainMenuOptions.SERVICES:
-            services_msg = (
-                "🔧 *Our Services* 🔧\n\n"
-                "We offer complete digital solutions:\n"
-                "Select a service to learn more:"
-            )
-            service_options = [option.value for option in ServiceOptions]
-            send_list_message(services_msg, service_options, user_data['sender'], phone_id)
-            update_user_state(user_data['sender'], {'step': 'services_menu'})
-            return {'step': 'services_menu'}
-
-        elif selected_option == MainMenuOptions.QUOTE:
-            # Show services menu with quote-specific message
-            quote_services_msg = (
-                "📋 *Request a Quote* 📋\n\n"
-                "Please select the service you would like a quotation for:"
-            )
-            service_options = [option.value for option in ServiceOptions]
-            send_list_message(quote_services_msg, service_options, user_data['sender'], phone_id)
-            update_user_state(user_data['sender'], {
-                'step': 'services_menu',
-                'quote_flow': True  # Flag to indicate this is for quote
-            })
-            return {
-                'step': 'services_menu',
-                'quote_flow': True
-            }
+    # Normalize input
+    normalized = prompt.strip().lower()
+    logging.debug("🧭 handle_main_menu() received prompt: %r", prompt)
+
+    # Try to match by list ID or exact row title first
+    selected_option = MAIN_MENU_IDS.get(normalized) or MAIN_MENU_LABELS.get(normalized)
+
+    # If not found, try to match by text (handles typed replies or button titles)
+    if not selected_option:
+        selected_option = match_option(normalized, MAIN_MENU_LABELS)
+    if not selected_option:
+        found = MAIN_MENU_LABEL_PATTERN.search(normalized)
+        if found:
+            selected_option = MAIN_MENU_LABELS[found.group()]
+
+    # If still not matched, re-prompt user
+    if not selected_option:
+        logging.debug("⚠️ No valid match for %r, staying in main_menu", prompt)
+        send_message("Please select a valid option from the list.", user_data['sender'], phone_id)
+        return {'step': 'main_menu'}
+
+    logging.debug("✅ Selected option: %s", selected_option.name)
+
+    # Every main menu choice just shows the next list menu
+    message, options, next_state = MAIN_MENU_RESPONSES[selected_option]
+    send_list_message(message, options, user_data['sender'], phone_id)
+    return dict(next_state)
+
+# Submenu choices that only send a text reply: the reply and the next state
+MENU_TEXT_RESPONSES = {
+    AboutOptions.PROFILE: (
+        "You can download our company profile from: https://contessasoft.co.zw/profile.pdf\n\n"
+        "Would you like to request more information?",
+        {'step': 'request_more_info'}
+    ),
+    ContactOptions.CALLBACK: (
+        "Please provide your name and the best time to call you:",
+        {'step': 'get_callback_details'}
+    )
+}
 
-        elif selected_option == MainMenuOptions.SUPPORT:
-            support_msg = "Please select the type of support you need:"
-            support_options = [option.value for option in SupportOptions]
-            send_list_message(support_msg, support_options, user_data['sender'], phone_id)
-            update_user_state(user_data['sender'], {'step': 'support_menu'})
-            return {'step': 'support_menu'}
-
-        elif selected_option == MainMenuOptions.CONTACT:
-            contact_msg = (
-                "You can reach Contessasoft through the following:\n\n"
-                "📍 Address: 115 ED Mnangagwa Road, Highlands, Harare, Zimbabwe\n"
-                "📞 WhatsApp: +263 242 498954\n"
-                "✉️ Email: sales@contessasoft.co.zw\n\n"
-                "Would you like to:"
-            )
-            contact_options = [option.value for option in ContactOptions]
-            send_list_message(contact_msg, contact_options, user_data['sender'], phone_id)
-            update_user_state(user_data['sender'], {'step': 'contact_menu'})
-            return {'step': 'contact_menu'}
+# Service details shown when a service is picked from the services menu
+SERVICE_INFO = {
+    ServiceOptions.DOMAIN: (
+        "🌐 *Domain & Hosting Services*\n\n"
+        "• Domain registration (.co.zw, .com, etc.)\n"
+        "• Reliable web hosting with 99.9% uptime\n"
+        "• Professional email hosting\n"
+        "• SSL certificates for security\n"
+        "• DNS management\n"
+        "• Website migration assistance"
+    ),
+    ServiceOptions.WEBSITE: (
+        "🖥️ *Website Development*\n\n"
+        "• Custom business websites\n"
+        "• E-commerce stores with payment integration\n"
+        "• Content Management Systems (CMS)\n"
+        "• Web application development\n"
+        "• SEO optimization\n"
+        "• Ongoing maintenance packages"
+    ),
+    ServiceOptions.MOBILE: (
+        "📱 *Mobile App Development*\n\n"
+        "• Native iOS and Android apps\n"
+        "• Cross-platform hybrid apps\n"
+        "• App UI/UX design\n"
+        "• API integration\n"
+        "• App Store and Play Store deployment\n"
+        "• Post-launch support"
+    ),
+    ServiceOptions.CHATBOT: (
+        "🤖 *WhatsApp Chatbots*\n\n"
+        "• Automated customer service\n"
+        "• Bill payment solutions (ZESA, DStv, etc.)\n"
+        "• Order processing systems\n"
+        "• KYC and registration flows\n"
+        "• FAQ and support automation\n"
+        "• Integration with business systems"
+    ),
+    ServiceOptions.PAYMENTS: (
+        "💳 *Payment Integrations*\n\n"
+        "• Ecocash/OneMoney/ZimSwitch\n"
+        "• VISA/Mastercard gateways\n"
+        "• PayPal and international payments\n"
+        "• Custom payment solutions\n"
+        "• PCI-DSS compliant setups\n"
+        "• Reconciliation reporting"
+    ),
+    ServiceOptions.AI: (
+        "🧠 *AI & Automation*\n\n"
+        "• Intelligent chatbots\n"
+        "• Document processing and OCR\n"
+        "• Predictive analytics\n"
+        "• Process automation\n"
+        "• Machine learning models\n"
+        "• Data extraction and analysis"
+    ),
+    ServiceOptions.DASHBOARDS: (
+        "📊 *Business Dashboards*\n\n"
+        "• Real-time business analytics\n"
+        "• Custom reporting tools\n"
+        "• Data visualization\n"
+        "• KPI tracking\n"
+        "• Executive dashboards\n"
+        "• Automated report generation"
+    ),
+    ServiceOptions.OTHER: (
+        "✨ *Custom Solutions*\n\n"
+        "We develop tailored software for:\n"
+        "• Inventory management\n"
+        "• School administration\n"
+        "• Healthcare systems\n"
+        "• Logistics tracking\n"
+        "• Financial services\n"
+        "• And other business needs"
+    )
+}
 
-    except Exception as e:
-        logging.error(f"Error in handle_main_menu: {e}\n{traceback.format_exc()}")
-        send_message("An error occurred. Please try again.", user_data['sender'], phone_id)
-        return {'step': 'welcome'}
+SERVICE_REPLY_HINT = "Please reply with:\n" + "\n".join(f"- {option.value}" for option in ServiceOptions)
 
 # Updated handle_services_menu to handle quote flow
+@safe_handler("⚠️ Please try selecting again or type 'menu'", fallback_step='services_menu')
 def handle_services_menu(prompt, user_data, phone_id):
-    try:
-        # Check if this is a quote flow
-        is_quote_flow = user_data.get('quote_flow', False)
-        
-        # Clean and normalize input
-        clean_input = prompt.strip().lower()
-        
-        # Improved matching logic
-        selected_option = None
+    # Check if this is a quote flow
+    is_quote_flow = user_data.get('quote_flow', False)
+    
+    # Clean and normalize input
+    clean_input = prompt.strip().lower()
+    
+    # Exact row titles (list replies) resolve directly, typed text is scored
+    selected_option = SERVICE_LABELS.get(clean_input)
+    
+    if not selected_option:
         best_match_score = 0
-        
-        for option in ServiceOptions:
-            option_text = option.value.lower()
-            
-            # Calculate match score (exact match gets highest priority)
-            if clean_input == option_text:
-                selected_option = option
-                break
-                
+        for option_text, option in SERVICE_LABELS.items():
             # Check for partial matches
             match_score = 0
             if clean_input in option_text:
@@ -684,304 +1148,181 @@ def handle_services_menu(prompt, user_data, phone_id):
                 best_match_score = match_score
                 selected_option = option
 
-        if not selected_option:
-            if is_quote_flow:
-                error_msg = "📋 Please select a service you would like a quotation for:"
-            else:
-                error_msg = "🚫 Please select a valid service option:"
-            
-            service_options = [opt.value for opt in ServiceOptions]
-            
-            if not send_list_message(error_msg, service_options, user_data['sender'], phone_id):
-                send_message(
-                    "Please reply with:\n" + "\n".join(f"- {opt.value}" for opt in ServiceOptions),
-                    user_data['sender'],
-                    phone_id
-                )
-            return {'step': 'services_menu', 'quote_flow': is_quote_flow}
-
-        # Handle the selected service
-        service_info = {
-            ServiceOptions.DOMAIN: (
-                "🌐 *Domain & Hosting Services*\n\n"
-                "• Domain registration (.co.zw, .com, etc.)\n"
-                "• Reliable web hosting with 99.9% uptime\n"
-                "• Professional email hosting\n"
-                "• SSL certificates for security\n"
-                "• DNS management\n"
-                "• Website migration assistance"
-            ),
-            ServiceOptions.WEBSITE: (
-                "🖥️ *Website Development*\n\n"
-                "• Custom business websites\n"
-                "• E-commerce stores with payment integration\n"
-                "• Content Management Systems (CMS)\n"
-                "• Web application development\n"
-                "• SEO optimization\n"
-                "• Ongoing maintenance packages"
-            ),
-            ServiceOptions.MOBILE: (
-                "📱 *Mobile App Development*\n\n"
-                "• Native iOS and Android apps\n"
-                "• Cross-platform hybrid apps\n"
-                "• App UI/UX design\n"
-                "• API integration\n"
-                "• App Store and Play Store deployment\n"
-                "• Post-launch support"
-            ),
-            ServiceOptions.CHATBOT: (
-                "🤖 *WhatsApp Chatbots*\n\n"
-                "• Automated customer service\n"
-                "• Bill payment solutions (ZESA, DStv, etc.)\n"
-                "• Order processing systems\n"
-                "• KYC and registration flows\n"
-                "• FAQ and support automation\n"
-                "• Integration with business systems"
-            ),
-            ServiceOptions.PAYMENTS: (
-                "💳 *Payment Integrations*\n\n"
-                "• Ecocash/OneMoney/ZimSwitch\n"
-                "• VISA/Mastercard gateways\n"
-                "• PayPal and international payments\n"
-                "• Custom payment solutions\n"
-                "• PCI-DSS compliant setups\n"
-                "• Reconciliation reporting"
-            ),
-            ServiceOptions.AI: (
-                "🧠 *AI & Automation*\n\n"
-                "• Intelligent chatbots\n"
-                "• Document processing and OCR\n"
-                "• Predictive analytics\n"
-                "• Process automation\n"
-                "• Machine learning models\n"
-                "• Data extraction and analysis"
-            ),
-            ServiceOptions.DASHBOARDS: (
-                "📊 *Business Dashboards*\n\n"
-                "• Real-time business analytics\n"
-                "• Custom reporting tools\n"
-                "• Data visualization\n"
-                "• KPI tracking\n"
-                "• Executive dashboards\n"
-                "• Automated report generation"
-            ),
-            ServiceOptions.OTHER: (
-                "✨ *Custom Solutions*\n\n"
-                "We develop tailored software for:\n"
-                "• Inventory management\n"
-                "• School administration\n"
-                "• Healthcare systems\n"
-                "• Logistics tracking\n"
-                "• Financial services\n"
-                "• And other business needs"
+    if not selected_option:
+        if is_quote_flow:
+            error_msg = "📋 Please select a service you would like a quotation for:"
+        else:
+            error_msg = "🚫 Please select a valid service option:"
+        
+        service_options = SERVICE_VALUES
+        
+        if not send_list_message(error_msg, service_options, user_data['sender'], phone_id):
+            send_message(
+                SERVICE_REPLY_HINT,
+                user_data['sender'],
+                phone_id
             )
-        }.get(selected_option, "ℹ️ Service information coming soon")
-
-        # Store the selected service for quote reference
-        update_user_state(user_data['sender'], {
-            'step': 'service_detail',
-            'selected_service': selected_option.name,
-            'service_description': selected_option.value,
-            'quote_flow': is_quote_flow  # Pass the quote flow flag
-        })
+        return {'step': 'services_menu', 'quote_flow': is_quote_flow}
+
+    # Handle the selected service
+    service_info = SERVICE_INFO.get(selected_option, "ℹ️ Service information coming soon")
 
-        # Prepare the buttons
+    # Prepare the buttons
+    if is_quote_flow:
+        # In quote flow, only show "Request Quote" button
+        buttons = QUOTE_BUTTONS
+        service_info = f"{service_info}\n\n💬 *Ready to get a quote for {selected_option.value}?*"
+    else:
+        # Normal flow, show both buttons
+        buttons = SERVICE_DETAIL_BUTTONS
+
+    # Send interactive button message
+    send_button_message(
+        service_info,
+        buttons,
+        user_data['sender'],
+        phone_id
+    )
+        
+    # Store the selected service for quote reference
+    return {
+        'step': 'service_detail',
+        'selected_service': selected_option.name,
+        'service_description': selected_option.value,
+        'quote_flow': is_quote_flow  # Pass the quote flow flag
+    }
+
+# Updated handle_service_detail to handle quote flow
+@safe_handler(fallback_step='services_menu')
+def handle_service_detail(prompt, user_data, phone_id):
+    # Check if this is a quote flow
+    is_quote_flow = user_data.get('quote_flow', False)
+    
+    # Clean the input and check for button responses
+    clean_input = prompt.strip().lower()
+    
+    # Handle "Request Quote" button or text
+    if "quote" in clean_input or "request quote" in clean_input or "💬" in prompt or prompt == "quote_btn":
+        # Initialize user object for quote collection
+        user = User(name="", phone=user_data['sender'])
+        user_dict = user.to_dict()
+        send_message("To help us prepare a quote, please provide your full name:", user_data['sender'], phone_id)
+        return {
+            'step': 'get_quote_info',
+            'user': user_dict,
+            'field': 'name',  # First field to collect
+            'quote_flow': is_quote_flow
+        }
+        
+    # Handle "Back to Services" button or text (only in non-quote flow)
+    elif ("back" in clean_input or "services" in clean_input or "🔙" in prompt or prompt == "back_btn") and not is_quote_flow:
+        services_msg = (
+            "🔧 *Our Services* 🔧\n\n"
+            "We offer complete digital solutions:\n"
+            "Select a service to learn more:"
+        )
+        service_options = SERVICE_VALUES
+        send_list_message(
+            services_msg,
+            service_options,
+            user_data['sender'],
+            phone_id
+        )
+        return {'step': 'services_menu'}
+        
+    # If the input doesn't match any expected option
+    else:
+        # Resend the service info with appropriate buttons
+        service_info = (
+            f"ℹ️ *{user_data.get('service_description', 'Selected Service')}*\n\n"
+            "Please choose an option:"
+        )
+        
         if is_quote_flow:
-            # In quote flow, only show "Request Quote" button
-            buttons = [
-                {"id": "quote_btn", "title": "💬 Request Quote"}
-            ]
-            service_info = f"{service_info}\n\n💬 *Ready to get a quote for {selected_option.value}?*"
+            buttons = QUOTE_BUTTONS
         else:
-            # Normal flow, show both buttons
-            buttons = [
-                {"id": "quote_btn", "title": "💬 Request Quote"},
-                {"id": "back_btn", "title": "🔙 Back to Services"}
-            ]
-
-        # Send interactive button message
+            buttons = SERVICE_DETAIL_BUTTONS
+            
         send_button_message(
             service_info,
             buttons,
             user_data['sender'],
             phone_id
         )
-            
+        return {'step': 'service_detail', 'quote_flow': is_quote_flow}
+
+# Updated handle_get_quote_info to include "anything else" after completion
+@safe_handler()
+def handle_get_quote_info(prompt, user_data, phone_id):
+    current_field = user_data.get('field')
+    
+    # Name and email are plain string fields, so set them on the stored
+    # dict directly; the full User is only rebuilt for the final summary
+    if current_field == 'name':
+        user_dict = {**user_data['user'], 'name': prompt}
+        send_message("Thank you. Please provide your email address:", user_data['sender'], phone_id)
         return {
-            'step': 'service_detail',
-            'selected_service': selected_option.name,
-            'quote_flow': is_quote_flow
+            'step': 'get_quote_info',
+            'user': user_dict,
+            'field': 'email',
+            'quote_flow': user_data.get('quote_flow', False)
         }
-            
-    except Exception as e:
-        logging.error(f"Service menu error: {str(e)}\n{traceback.format_exc()}")
-        send_message("⚠️ Please try selecting again or type 'menu'", user_data['sender'], phone_id)
-        return {'step': 'services_menu', 'quote_flow': user_data.get('quote_flow', False)}
-
-# Updated handle_service_detail to handle quote flow
-def handle_service_detail(prompt, user_data, phone_id):
-    try:
-        # Check if this is a quote flow
-        is_quote_flow = user_data.get('quote_flow', False)
         
-        # Clean the input and check for button responses
-        clean_input = prompt.strip().lower()
+    elif current_field == 'email':
+        user_dict = {**user_data['user'], 'email': prompt}
+        send_message("Please provide a short description of your project:", user_data['sender'], phone_id)
+        return {
+            'step': 'get_quote_info',
+            'user': user_dict,
+            'field': 'description',
+            'quote_flow': user_data.get('quote_flow', False)
+        }
         
-        # Handle "Request Quote" button or text
-        if "quote" in clean_input or "request quote" in clean_input or "💬" in prompt or prompt == "quote_btn":
-            # Initialize user object for quote collection
-            user = User(name="", phone=user_data['sender'])
-            update_user_state(user_data['sender'], {
-                'step': 'get_quote_info',
-                'user': user.to_dict(),
-                'field': 'name',  # First field to collect
-                'selected_service': user_data.get('selected_service'),
-                'service_description': user_data.get('service_description'),
-                'quote_flow': is_quote_flow
-            })
-            send_message("To help us prepare a quote, please provide your full name:", user_data['sender'], phone_id)
-            return {
-                'step': 'get_quote_info',
-                'user': user.to_dict(),
-                'field': 'name',
-                'quote_flow': is_quote_flow
-            }
-            
-        # Handle "Back to Services" button or text (only in non-quote flow)
-        elif ("back" in clean_input or "services" in clean_input or "🔙" in prompt or prompt == "back_btn") and not is_quote_flow:
-            services_msg = (
-                "🔧 *Our Services* 🔧\n\n"
-                "We offer complete digital solutions:\n"
-                "Select a service to learn more:"
-            )
-            service_options = [option.value for option in ServiceOptions]
-            send_list_message(
-                services_msg,
-                service_options,
-                user_data['sender'],
-                phone_id
-            )
-            update_user_state(user_data['sender'], {'step': 'services_menu'})
-            return {'step': 'services_menu'}
-            
-        # If the input doesn't match any expected option
-        else:
-            # Resend the service info with appropriate buttons
-            service_info = (
-                f"ℹ️ *{user_data.get('service_description', 'Selected Service')}*\n\n"
-                "Please choose an option:"
-            )
-            
-            if is_quote_flow:
-                buttons = [
-                    {"id": "quote_btn", "title": "💬 Request Quote"}
-                ]
-            else:
-                buttons = [
-                    {"id": "quote_btn", "title": "💬 Request Quote"},
-                    {"id": "back_btn", "title": "🔙 Back to Services"}
-                ]
-                
-            send_button_message(
-                service_info,
-                buttons,
-                user_data['sender'],
-                phone_id
-            )
-            return {'step': 'service_detail', 'quote_flow': is_quote_flow}
-            
-    except Exception as e:
-        logging.error(f"Error in handle_service_detail: {e}")
-        send_message("An error occurred. Please try again.", user_data['sender'], phone_id)
-        return {'step': 'services_menu', 'quote_flow': user_data.get('quote_flow', False)}
-
-# Updated handle_get_quote_info to include "anything else" after completion
-def handle_get_quote_info(prompt, user_data, phone_id):
-    try:
-        user = User.from_dict(user_data['user'])
-        current_field = user_data.get('field')
+    elif current_field == 'description':
+        user_dict = {**user_data['user'], 'project_description': prompt}
         
-        if current_field == 'name':
-            user.name = prompt
-            update_user_state(user_data['sender'], {
-                'step': 'get_quote_info',
-                'user': user.to_dict(),
-                'field': 'email',
-                'quote_flow': user_data.get('quote_flow', False)
-            })
-            send_message("Thank you. Please provide your email address:", user_data['sender'], phone_id)
-            return {
-                'step': 'get_quote_info',
-                'user': user.to_dict(),
-                'field': 'email',
-                'quote_flow': user_data.get('quote_flow', False)
-            }
-            
-        elif current_field == 'email':
-            user.email = prompt
-            update_user_state(user_data['sender'], {
-                'step': 'get_quote_info',
-                'user': user.to_dict(),
-                'field': 'description',
-                'quote_flow': user_data.get('quote_flow', False)
-            })
-            send_message("Please provide a short description of your project:", user_data['sender'], phone_id)
-            return {
-                'step': 'get_quote_info',
-                'user': user.to_dict(),
-                'field': 'description',
-                'quote_flow': user_data.get('quote_flow', False)
-            }
-            
-        elif current_field == 'description':
-            user.project_description = prompt
-            
-            # Generate quote reference
-            quote_reference = generate_quote_reference()
-            
-            # Prepare quote data
-            quote_data = {
-                'user': user.to_dict(),
-                'service_type': user_data.get('service_description', 'General'),
-                'selected_service': user_data.get('selected_service'),
-                'quote_reference': quote_reference,
-                'status': 'submitted'
-            }
-            
-            # Save quote request to separate Redis key
-            save_quote_request(quote_reference, quote_data)
-            
-            # Send quote request to admin
-            quote_msg = (
-                f"📋 *New Quote Request* - {quote_reference}\n\n"
-                f"👤 Name: {user.name}\n"
-                f"📞 Phone: {user.phone}\n"
-                f"📧 Email: {user.email}\n"
-                f"🛠️ Service: {user_data.get('service_description', 'General')}\n"
-                f"📝 Description: {user.project_description}\n"
-                f"⏰ Submitted: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            )
-            
-            if owner_phone:
-                send_message(quote_msg, owner_phone, phone_id)
-            
-            # Send confirmation to user
-            send_message(
-                f"Thank you! Your quote request has been submitted.\n\n"
-                f"📋 *Quote Reference:* {quote_reference}\n"
-                f"⏰ We'll contact you within 24 hours.\n"
-                f"📞 For urgent inquiries, call: +263 242 498954",
-                user_data['sender'],
-                phone_id
-            )
-            
-            # After quote completion, ask if anything else is needed
-            return handle_anything_else("", user_data, phone_id)
-            
-    except Exception as e:
-        logging.error(f"Error in handle_get_quote_info: {e}")
-        send_message("An error occurred. Please try again.", user_data['sender'], phone_id)
-        return {'step': 'welcome'}
+        # Generate quote reference
+        quote_reference = generate_quote_reference()
+        
+        # Prepare quote data
+        quote_data = {
+            'user': user_dict,
+            'service_type': user_data.get('service_description', 'General'),
+            'selected_service': user_data.get('selected_service'),
+            'quote_reference': quote_reference,
+            'status': 'submitted'
+        }
+        
+        # Save quote request to separate Redis key
+        save_quote_request(quote_reference, quote_data)
+        
+        # Send quote request to admin
+        quote_msg = QUOTE_REQUEST_TEMPLATE.format_map({
+            'reference': quote_reference,
+            'name': user_dict.get('name'),
+            'phone': user_dict.get('phone'),
+            'email': user_dict.get('email'),
+            'service': quote_data['service_type'],
+            'description': prompt,
+            'submitted': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        
+        admin_notice = notify_owner(quote_msg, phone_id)
+        
+        # Send confirmation to user
+        send_message(
+            f"Thank you! Your quote request has been submitted.\n\n"
+            f"📋 *Quote Reference:* {quote_reference}\n"
+            f"⏰ We'll contact you within 24 hours.\n"
+            f"📞 For urgent inquiries, call: +263 242 498954",
+            user_data['sender'],
+            phone_id
+        )
+        if admin_notice:
+            admin_notice.result()
+        
+        # After quote completion, ask if anything else is needed
+        return handle_anything_else("", user_data, phone_id)
 
 # [Include all other handler functions: handle_welcome, handle_restart_confirmation, handle_about_menu, etc.]
 # They remain the same as before...
@@ -993,7 +1334,7 @@ def handle_welcome(prompt, user_data, phone_id):
         "Please choose an option to continue:"
     )
     
-    menu_options = [option.value for option in MainMenuOptions]
+    menu_options = MAIN_MENU_VALUES
     send_list_message(
         welcome_msg,
         menu_options,
@@ -1001,255 +1342,196 @@ def handle_welcome(prompt, user_data, phone_id):
         phone_id
     )
     
-    update_user_state(user_data['sender'], {'step': 'main_menu'})
     return {'step': 'main_menu'}
 
+@safe_handler("An error occurred. Returning to main menu.")
 def handle_restart_confirmation(prompt, user_data, phone_id):
-    try:
-        text = (prompt or "").strip().lower()
-
-        # Initial entry or unrecognized input -> show Yes/No buttons
-        if text == "" or text in ["restart", "start", "menu"]:
-            send_button_message(
-                "Would you like to go back to main menu?",
-                [
-                    {"id": "restart_yes", "title": "Yes"},
-                    {"id": "restart_no", "title": "No"}
-                ],
-                user_data['sender'],
-                phone_id
-            )
-            update_user_state(user_data['sender'], {'step': 'restart_confirmation'})
-            return {'step': 'restart_confirmation'}
+    text = (prompt or "").strip().lower()
 
-        # Positive confirmation -> go to welcome flow
-        if text in ["yes", "y", "restart_yes", "ok", "sure", "yeah", "yep"]:
-            return handle_welcome("", user_data, phone_id)
-
-        # Negative confirmation -> send goodbye and reset to welcome state
-        if text in ["no", "n", "restart_no", "nope", "nah"]:
-            send_message("Have a good day!", user_data['sender'], phone_id)
-            update_user_state(user_data['sender'], {'step': 'welcome'})
-            return {'step': 'welcome'}
-
-        # Any other input -> re-send buttons
+    # Initial entry or unrecognized input -> show Yes/No buttons
+    if text == "" or text in RESTART_REPLIES:
         send_button_message(
-            "Please confirm: would you like to restart with the bot?",
-            [
-                {"id": "restart_yes", "title": "Yes"},
-                {"id": "restart_no", "title": "No"}
-            ],
+            "Would you like to go back to main menu?",
+            RESTART_BUTTONS,
             user_data['sender'],
             phone_id
         )
         return {'step': 'restart_confirmation'}
 
-    except Exception as e:
-        logging.error(f"Error in handle_restart_confirmation: {e}")
-        send_message("An error occurred. Returning to main menu.", user_data['sender'], phone_id)
-        return {'step': 'welcome'}
+    # Positive confirmation -> go to welcome flow
+    if text in YES_REPLIES or text == "restart_yes":
+        return handle_welcome("", user_data, phone_id)
 
-def handle_about_menu(prompt, user_data, phone_id):
-    try:
-        selected_option = None
-        for option in AboutOptions:
-            if prompt.lower() in option.value.lower():
-                selected_option = option
-                break
-                
-        if not selected_option:
-            send_message("Invalid selection. Please choose an option from the list.", user_data['sender'], phone_id)
-            return {'step': 'about_menu'}
-            
-        if selected_option == AboutOptions.PORTFOLIO:
-            portfolio_msg = (
-                "Our portfolio includes:\n"
-                "- Banking systems\n"
-                "- School management systems\n"
-                "- E-commerce platforms\n"
-                "- Logistics tracking systems\n"
-                "- Custom business automation"
-            )
-            send_message(portfolio_msg, user_data['sender'], phone_id)
-            # After showing portfolio, ask if anything else is needed
-            return handle_anything_else("", user_data, phone_id)
-            
-        elif selected_option == AboutOptions.PROFILE:
-            send_message(
-                "You can download our company profile from: https://contessasoft.co.zw/profile.pdf\n\n"
-                "Would you like to request more information?",
-                user_data['sender'],
-                phone_id
-            )
-            update_user_state(user_data['sender'], {'step': 'request_more_info'})
-            return {'step': 'request_more_info'}
-            
-        elif selected_option == AboutOptions.BACK:
-            return handle_welcome("", user_data, phone_id)
-            
-    except Exception as e:
-        logging.error(f"Error in handle_about_menu: {e}")
-        send_message("An error occurred. Please try again.", user_data['sender'], phone_id)
+    # Negative confirmation -> send goodbye and reset to welcome state
+    if text in NO_REPLIES or text == "restart_no":
+        send_message("Have a good day!", user_data['sender'], phone_id)
         return {'step': 'welcome'}
 
-def handle_support_menu(prompt, user_data, phone_id):
-    try:
-        selected_option = None
-        for option in SupportOptions:
-            if prompt.lower() in option.value.lower():
-                selected_option = option
-                break
-                
-        if not selected_option:
-            send_message("Invalid selection. Please choose an option from the list.", user_data['sender'], phone_id)
-            return {'step': 'support_menu'}
-            
-        if selected_option == SupportOptions.BACK:
-            return handle_welcome("", user_data, phone_id)
+    # Any other input -> re-send buttons
+    send_button_message(
+        "Please confirm: would you like to restart with the bot?",
+        RESTART_BUTTONS,
+        user_data['sender'],
+        phone_id
+    )
+    return {'step': 'restart_confirmation'}
+
+@safe_handler()
+def handle_about_menu(prompt, user_data, phone_id):
+    selected_option = match_option(prompt, ABOUT_LABELS)
             
-        user = User(name="", phone=user_data['sender'])
-        user.support_type = selected_option
-        
-        update_user_state(user_data['sender'], {
-            'step': 'get_support_details',
-            'user': user.to_dict()
-        })
+    if not selected_option:
+        send_message("Invalid selection. Please choose an option from the list.", user_data['sender'], phone_id)
+        return {'step': 'about_menu'}
         
-        send_message(
-            "Please describe your issue in detail:",
-            user_data['sender'],
-            phone_id
+    if selected_option == AboutOptions.PORTFOLIO:
+        portfolio_msg = (
+            "Our portfolio includes:\n"
+            "- Banking systems\n"
+            "- School management systems\n"
+            "- E-commerce platforms\n"
+            "- Logistics tracking systems\n"
+            "- Custom business automation"
         )
+        send_message(portfolio_msg, user_data['sender'], phone_id)
+        # After showing portfolio, ask if anything else is needed
+        return handle_anything_else("", user_data, phone_id)
         
-        return {
-            'step': 'get_support_details',
-            'user': user.to_dict()
-        }
+    elif selected_option in MENU_TEXT_RESPONSES:
+        message, next_state = MENU_TEXT_RESPONSES[selected_option]
+        send_message(message, user_data['sender'], phone_id)
+        return dict(next_state)
         
-    except Exception as e:
-        logging.error(f"Error in handle_support_menu: {e}")
-        send_message("An error occurred. Please try again.", user_data['sender'], phone_id)
-        return {'step': 'welcome'}
+    elif selected_option == AboutOptions.BACK:
+        return handle_welcome("", user_data, phone_id)
 
-def handle_get_support_details(prompt, user_data, phone_id):
-    try:
-        user = User.from_dict(user_data['user'])
-        user.project_description = prompt
-        
-        # Send support request to admin
-        support_msg = (
-            f"🆘 *New Support Request*\n\n"
-            f"👤 From: {user.name or 'Customer'} - {user.phone}\n"
-            f"🔧 Type: {user.support_type.value if user.support_type else 'General'}\n"
-            f"📝 Details: {prompt}"
-        )
-        
-        if owner_phone:
-            send_message(support_msg, owner_phone, phone_id)
-        
-        send_message(
-            "Thank you! Your support request has been logged. Our team will respond shortly.\n"
-            "Reference: #" + ''.join(random.choices(string.ascii_uppercase + string.digits, k=6)),
-            user_data['sender'],
-            phone_id
-        )
+@safe_handler()
+def handle_support_menu(prompt, user_data, phone_id):
+    selected_option = match_option(prompt, SUPPORT_LABELS)
+            
+    if not selected_option:
+        send_message("Invalid selection. Please choose an option from the list.", user_data['sender'], phone_id)
+        return {'step': 'support_menu'}
         
-        # After support completion, ask if anything else is needed
-        return handle_anything_else("", user_data, phone_id)
+    if selected_option == SupportOptions.BACK:
+        return handle_welcome("", user_data, phone_id)
         
-    except Exception as e:
-        logging.error(f"Error in handle_get_support_details: {e}")
-        send_message("An error occurred. Please try again.", user_data['sender'], phone_id)
-        return {'step': 'welcome'}
+    user = User(name="", phone=user_data['sender'])
+    user.support_type = selected_option
+    user_dict = user.to_dict()
+    
+    send_message(
+        "Please describe your issue in detail:",
+        user_data['sender'],
+        phone_id
+    )
+    
+    return {
+        'step': 'get_support_details',
+        'user': user_dict
+    }
+
+@safe_handler()
+def handle_get_support_details(prompt, user_data, phone_id):
+    # The stored user dict already holds the support type's display value,
+    # so there's no need to rebuild the User and its enums to format it
+    user_dict = user_data['user']
+    
+    # Send support request to admin
+    support_msg = SUPPORT_REQUEST_TEMPLATE.format_map({
+        'name': user_dict.get('name') or 'Customer',
+        'phone': user_dict.get('phone'),
+        'support_type': user_dict.get('support_type') or 'General',
+        'details': prompt
+    })
+    
+    admin_notice = notify_owner(support_msg, phone_id)
+    
+    send_message(
+        "Thank you! Your support request has been logged. Our team will respond shortly.\n"
+        "Reference: #" + generate_reference(),
+        user_data['sender'],
+        phone_id
+    )
+    if admin_notice:
+        admin_notice.result()
+    
+    # After support completion, ask if anything else is needed
+    return handle_anything_else("", user_data, phone_id)
 
+@safe_handler()
 def handle_contact_menu(prompt, user_data, phone_id):
-    try:
-        selected_option = None
-        for option in ContactOptions:
-            if prompt.lower() in option.value.lower():
-                selected_option = option
-                break
-                
-        if not selected_option:
-            send_message("Invalid selection. Please choose an option from the list.", user_data['sender'], phone_id)
-            return {'step': 'contact_menu'}
+    selected_option = match_option(prompt, CONTACT_LABELS)
             
-        if selected_option == ContactOptions.CALLBACK:
-            send_message(
-                "Please provide your name and the best time to call you:",
-                user_data['sender'],
-                phone_id
-            )
-            update_user_state(user_data['sender'], {'step': 'get_callback_details'})
-            return {'step': 'get_callback_details'}
-            
-        elif selected_option == ContactOptions.AGENT:
-            send_message(
-                "Please wait while we connect you with an agent...",
-                user_data['sender'],
-                phone_id
-            )
-            # Notify agents
-            agent_msg = f"🔔 New agent request from: {user_data['sender']}"
-            for agent in AGENT_NUMBERS:
-                send_message(agent_msg, agent, phone_id)
-            
-            return handle_welcome("", user_data, phone_id)
-            
-        elif selected_option == ContactOptions.BACK:
-            return handle_welcome("", user_data, phone_id)
-            
-    except Exception as e:
-        logging.error(f"Error in handle_contact_menu: {e}")
-        send_message("An error occurred. Please try again.", user_data['sender'], phone_id)
-        return {'step': 'welcome'}
-
-def handle_get_callback_details(prompt, user_data, phone_id):
-    try:
-        # Send callback request to admin
-        callback_msg = (
-            f"📞 *Callback Request*\n\n"
-            f"📞 From: {user_data['sender']}\n"
-            f"📝 Details: {prompt}"
-        )
+    if not selected_option:
+        send_message("Invalid selection. Please choose an option from the list.", user_data['sender'], phone_id)
+        return {'step': 'contact_menu'}
         
-        if owner_phone:
-            send_message(callback_msg, owner_phone, phone_id)
+    if selected_option in MENU_TEXT_RESPONSES:
+        message, next_state = MENU_TEXT_RESPONSES[selected_option]
+        send_message(message, user_data['sender'], phone_id)
+        return dict(next_state)
         
+    elif selected_option == ContactOptions.AGENT:
+        # Notify agents alongside the customer reply rather than one after another
+        agent_msg = f"🔔 New agent request from: {user_data['sender']}"
+        agent_notices = [notify_staff(agent_msg, agent, phone_id) for agent in AGENT_NUMBERS]
         send_message(
-            "Thank you! We'll call you at the requested time.\n"
-            "Reference: #" + ''.join(random.choices(string.ascii_uppercase + string.digits, k=6)),
+            "Please wait while we connect you with an agent...",
             user_data['sender'],
             phone_id
         )
+        for notice in agent_notices:
+            if notice:
+                notice.result()
         
-        # After callback completion, ask if anything else is needed
-        return handle_anything_else("", user_data, phone_id)
+        return handle_welcome("", user_data, phone_id)
         
-    except Exception as e:
-        logging.error(f"Error in handle_get_callback_details: {e}")
-        send_message("An error occurred. Please try again.", user_data['sender'], phone_id)
-        return {'step': 'welcome'}
+    elif selected_option == ContactOptions.BACK:
+        return handle_welcome("", user_data, phone_id)
+
+@safe_handler()
+def handle_get_callback_details(prompt, user_data, phone_id):
+    # Send callback request to admin
+    callback_msg = CALLBACK_REQUEST_TEMPLATE.format_map({
+        'phone': user_data['sender'],
+        'details': prompt
+    })
+    
+    admin_notice = notify_owner(callback_msg, phone_id)
+    
+    send_message(
+        "Thank you! We'll call you at the requested time.\n"
+        "Reference: #" + generate_reference(),
+        user_data['sender'],
+        phone_id
+    )
+    if admin_notice:
+        admin_notice.result()
+    
+    # After callback completion, ask if anything else is needed
+    return handle_anything_else("", user_data, phone_id)
 
 # Agent message handler
 def handle_agent_message(prompt, sender, phone_id):
     """Handle messages from agents when no chat is transferred"""
     try:
-        print(f"🔧 Agent message from {sender}: '{prompt}'")
+        logging.debug("🔧 Agent message from %s: %r", sender, prompt)
         
         # Check if this agent has any active conversations
         active_conversations = []
         try:
-            # Look for any active conversations where this agent is assigned
-            conversation_keys = redis_client.keys("agent_conversation:*")
-            for key in conversation_keys:
-                conv_data_raw = redis_client.get(key)
-                if conv_data_raw:
-                    conv_data = json.loads(conv_data_raw)
-                    if conv_data.get('agent') == sender and conv_data.get('active'):
-                        active_conversations.append(conv_data)
+            # Look for any active conversations where this agent is assigned,
+            # fetching all of them in one MGET
+            conversation_keys = scan_keys("agent_conversation:*")
+            if conversation_keys:
+                for conv_data_raw in redis_client.mget(*conversation_keys):
+                    if conv_data_raw:
+                        conv_data = loads_state(conv_data_raw)
+                        if conv_data.get('agent') == sender and conv_data.get('active'):
+                            active_conversations.append(conv_data)
         except Exception as e:
-            print(f"❌ Error checking agent conversations: {e}")
+            logging.error("❌ Error checking agent conversations: %s", e)
         
         if not active_conversations:
             # No active conversations - inform agent to wait
@@ -1259,7 +1541,7 @@ def handle_agent_message(prompt, sender, phone_id):
                 sender,
                 phone_id
             )
-            print(f"ℹ️ Agent {sender} has no active conversations")
+            logging.debug("ℹ️ Agent %s has no active conversations", sender)
         else:
             # Agent has active conversations - remind them of the conversation IDs
             conversation_info = "\n".join([f"- {conv.get('conversation_id')} (Customer: {conv.get('customer')})" 
@@ -1271,8 +1553,8 @@ def handle_agent_message(prompt, sender, phone_id):
                 phone_id
             )
             
-    except Exception as e:
-        logging.error(f"Error in handle_agent_message: {e}")
+    except Exception:
+        logging.exception("Error in handle_agent_message")
         send_message("An error occurred processing your message.", sender, phone_id)
 
 # Action mapping
@@ -1293,54 +1575,208 @@ action_mapping = {
 
 def get_action(current_state, prompt, user_data, phone_id):
     handler = action_mapping.get(current_state, handle_welcome)
-    print(f"🔄 Routing to handler: {handler.__name__} for state: {current_state}")
+    logging.debug("🔄 Routing to handler: %s for state: %s", handler.__name__, current_state)
 
     try:
         return handler(prompt, user_data, phone_id)
-    except Exception as e:
-        logging.error(f"Error in handler {handler.__name__}: {e}", exc_info=True)
+    except Exception:
+        logging.exception("Error in handler %s", handler.__name__)
         return handle_welcome("", user_data, phone_id)
 
 # Message handler
 def message_handler(prompt, sender, phone_id):
     text = prompt.strip().lower()
-    print(f"💬 Message from {sender}: '{prompt}'")
+    logging.debug("💬 Message from %s: %r", sender, prompt)
 
     # Check if sender is an agent
     normalized_sender = normalize_phone_number(sender)
-    if normalized_sender in AGENT_NUMBERS or sender in AGENT_NUMBERS:
-        print(f"🔧 Agent message received from {sender}")
+    if normalized_sender in AGENT_NUMBERS:
+        logging.debug("🔧 Agent message received from %s", sender)
         # Handle agent message separately
         handle_agent_message(prompt, sender, phone_id)
         return
 
-    # Save user message to conversation history
-    save_conversation_message(sender, prompt, is_user=True)
-    
     # Get user state
     user_data = get_user_state(sender)
     user_data['sender'] = sender
     
-    print(f"📊 User state: {user_data}")
+    # Save user message to conversation history
+    save_conversation_message(sender, prompt, is_user=True, step=user_data.get('step'))
+    
+    logging.debug("📊 User state: %s", user_data)
 
-    # Handle start commands
-    if text in ["hi", "hello", "hie", "hey", "start"]:
+    # Handlers only return the state changes; they are saved once below
+    restart = False
+    if text in GREETINGS:
+        # Handle start commands
         user_data = {'step': 'welcome', 'sender': sender}
         updated_state = get_action('welcome', "", user_data, phone_id)
-        update_user_state(sender, updated_state)
+        restart = True
+    elif text in RESTART_COMMANDS:
+        # Handle restart commands
+        updated_state = handle_restart_confirmation("", user_data, phone_id)
+    else:
+        step = user_data.get('step') or 'welcome'
+        logging.debug("📍 Current step: %s", step)
+        updated_state = get_action(step, prompt, user_data, phone_id)
+
+    update_user_state(sender, updated_state, user_data, replace=restart)
+
+# Webhook processing
+def process_webhook(data):
+    """Route each message in a webhook payload to message_handler"""
+    entries = data.get("entry", [])
+    if not entries:
+        logging.warning("❌ No entries in webhook")
         return
 
-    # Handle restart commands
-    if text in ["restart", "menu"]:
-        user_data = handle_restart_confirmation("", user_data, phone_id)
-        update_user_state(sender, user_data)
-        return
+    for entry in entries:
+        changes = entry.get("changes", [])
+        for change in changes:
+            value = change.get("value", {})
+            metadata = value.get("metadata", {})
+            current_phone_id = metadata.get("phone_number_id")
+            
+            if not current_phone_id:
+                logging.warning("❌ No phone ID in webhook")
+                continue
+                
+            messages = value.get("messages", [])
+            if not messages:
+                logging.debug("No messages in webhook")
+                continue
+                
+            message = messages[0]
+            sender = message.get("from")
+            if not sender:
+                logging.warning("❌ No sender in message")
+                continue
+
+            # Handle different message types
+            if "text" in message:
+                text = message["text"].get("body", "").strip()
+                if text:
+                    message_handler(text, sender, current_phone_id)
+            elif "interactive" in message:
+                interactive = message["interactive"]
+                logging.debug("🔘 Interactive message: %s", interactive)
+                
+                # Handle list replies
+                if interactive.get("type") == "list_reply":
+                    list_reply = interactive.get("list_reply", {})
+                    reply_id = list_reply.get("id", "")
+                    reply_title = list_reply.get("title", "").strip()
+                    logging.debug("📋 List reply - ID: %s, Title: %s", reply_id, reply_title)
+                    if reply_title:
+                        message_handler(reply_title, sender, current_phone_id)
+                
+                # Handle button replies
+                elif interactive.get("type") == "button_reply":
+                    button_reply = interactive.get("button_reply", {})
+                    button_id = button_reply.get("id", "")
+                    button_title = button_reply.get("title", "").strip()
+                    logging.debug("🔘 Button reply - ID: %s, Title: %s", button_id, button_title)
+                    
+                    if button_id:
+                        message_handler(button_id, sender, current_phone_id)
+                    elif button_title:
+                        message_handler(button_title, sender, current_phone_id)
+
+# Webhooks are acknowledged as soon as they are queued. Meta retries webhooks
+# that are slow to acknowledge, which would otherwise duplicate work. Payloads
+# are split per change and sharded across worker threads by sender: different
+# users are handled concurrently while each user's messages are processed in
+# order by one thread.
+WEBHOOK_WORKERS = 8
+webhook_queues = [queue.Queue(maxsize=1000) for _ in range(WEBHOOK_WORKERS)]
+
+def webhook_queue_for(change):
+    """Pick the worker queue for a webhook change based on its sender"""
+    try:
+        sender = change["value"]["messages"][0]["from"]
+    except (KeyError, IndexError, TypeError):
+        # Status updates and other sender-less changes
+        return webhook_queues[0]
+    return webhook_queues[hash(normalize_phone_number(sender)) % WEBHOOK_WORKERS]
+
+def split_webhook(data):
+    """Split a webhook payload into one payload per change, each paired with
+    the worker queue for its sender, so a batched delivery carrying several
+    senders is handled on each sender's own shard"""
+    pieces = []
+    for entry in data.get("entry") or []:
+        for change in entry.get("changes") or []:
+            piece = {"entry": [{**entry, "changes": [change]}]}
+            pieces.append((webhook_queue_for(change), piece))
+    return pieces
+
+def webhook_worker(webhook_queue):
+    while True:
+        data = webhook_queue.get()
+        if data is STOP_WORKER:
+            webhook_queue.task_done()
+            return
+        try:
+            process_webhook(data)
+        except Exception:
+            logging.exception("Webhook processing error")
+        finally:
+            webhook_queue.task_done()
+
+webhook_threads = []
+if BACKGROUND_WORKERS:
+    for i, shard in enumerate(webhook_queues):
+        thread = threading.Thread(target=webhook_worker, args=(shard,), daemon=True, name=f"webhook-{i}")
+        thread.start()
+        webhook_threads.append(thread)
+
+# Queued payloads have already been acknowledged to Meta, which won't resend
+# them, so they are finished before the process exits. Held while queueing so
+# no webhook is accepted after the workers have been told to stop.
+SHUTDOWN_TIMEOUT = 20.0
+webhook_intake_lock = threading.Lock()
+accepting_webhooks = True
+
+def queued_items(work_queue):
+    with work_queue.mutex:
+        return sum(item is not STOP_WORKER for item in work_queue.queue)
+
+def stop_background_workers():
+    """Stop accepting webhooks, then let the workers finish what is queued,
+    waiting at most SHUTDOWN_TIMEOUT seconds in total"""
+    global accepting_webhooks
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    with webhook_intake_lock:
+        if not accepting_webhooks:
+            return
+        accepting_webhooks = False
+    for shard in webhook_queues:
+        try:
+            shard.put(STOP_WORKER, timeout=max(0, deadline - time.monotonic()))
+        except queue.Full:
+            pass
+    # Webhook workers can still queue notifications, so they finish first
+    for thread in webhook_threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    if admin_thread is not None:
+        try:
+            admin_queue.put(STOP_WORKER, timeout=max(0, deadline - time.monotonic()))
+        except queue.Full:
+            pass
+        admin_thread.join(max(0, deadline - time.monotonic()))
+    unfinished_webhooks = sum(queued_items(shard) for shard in webhook_queues)
+    unfinished_notifications = queued_items(admin_queue)
+    if unfinished_webhooks or unfinished_notifications:
+        logging.error(
+            "Shutdown timed out with %d webhook payloads and %d notifications still queued",
+            unfinished_webhooks, unfinished_notifications
+        )
+    else:
+        logging.info("Background workers drained")
 
-    step = user_data.get('step') or 'welcome'
-    print(f"📍 Current step: {step}")
-    
-    updated_state = get_action(step, prompt, user_data, phone_id)
-    update_user_state(sender, updated_state)
+if BACKGROUND_WORKERS:
+    # gunicorn also calls this from its worker_exit hook; the second call is a no-op
+    atexit.register(stop_background_workers)
 
 # Admin endpoints
 @app.route("/conversation/<phone_number>", methods=["GET"])
@@ -1383,6 +1819,16 @@ def get_all_quotes():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Health check: pings Upstash Redis instead of doing it at import time"""
+    try:
+        redis_client.ping()
+        return jsonify({"status": "ok"})
+    except Exception as e:
+        logging.error("❌ Upstash Redis error: %s", e)
+        return jsonify({"status": "error", "error": str(e)}), 503
+
 @app.route("/", methods=["GET"])
 def index():
     return render_template("connected.html")
@@ -1396,86 +1842,54 @@ def webhook():
         challenge = request.args.get("hub.challenge")
         
         if mode == "subscribe" and token == "contessasoft":
-            print("✅ Webhook verified successfully!")
+            logging.info("✅ Webhook verified successfully!")
             return challenge
         else:
-            print("❌ Webhook verification failed!")
+            logging.warning("❌ Webhook verification failed!")
             return "Verification failed", 403
 
     elif request.method == "POST":
         try:
-            data = request.get_json()
-            print(f"📨 Webhook received: {json.dumps(data, indent=2)[:500]}...")
+            # Parse the raw body with the fast state decoder and log it as
+            # received, rather than re-serializing the payload for the preview
+            raw = request.get_data(cache=False)
+            data = loads_state(raw) if raw else None
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("📨 Webhook received: %s...", raw[:500].decode('utf-8', 'replace'))
 
             if not data:
-                print("❌ Empty webhook request")
-                return jsonify({"status": "ok"}), 200
-
-            entries = data.get("entry", [])
-            if not entries:
-                print("❌ No entries in webhook")
+                logging.warning("❌ Empty webhook request")
                 return jsonify({"status": "ok"}), 200
 
-            for entry in entries:
-                changes = entry.get("changes", [])
-                for change in changes:
-                    value = change.get("value", {})
-                    metadata = value.get("metadata", {})
-                    current_phone_id = metadata.get("phone_number_id")
-                    
-                    if not current_phone_id:
-                        print("❌ No phone ID in webhook")
-                        continue
-                        
-                    messages = value.get("messages", [])
-                    if not messages:
-                        print("❌ No messages in webhook")
-                        continue
-                        
-                    message = messages[0]
-                    sender = message.get("from")
-                    if not sender:
-                        print("❌ No sender in message")
-                        continue
-                    
-                    print(f"📱 Message from: {sender}")
-
-                    # Handle different message types
-                    if "text" in message:
-                        text = message["text"].get("body", "").strip()
-                        if text:
-                            print(f"💬 Text message: {text}")
-                            message_handler(text, sender, current_phone_id)
-                    elif "interactive" in message:
-                        interactive = message["interactive"]
-                        print(f"🔘 Interactive message: {interactive}")
-                        
-                        # Handle list replies
-                        if interactive.get("type") == "list_reply":
-                            list_reply = interactive.get("list_reply", {})
-                            reply_id = list_reply.get("id", "")
-                            reply_title = list_reply.get("title", "").strip()
-                            print(f"📋 List reply - ID: {reply_id}, Title: {reply_title}")
-                            if reply_title:
-                                message_handler(reply_title, sender, current_phone_id)
-                        
-                        # Handle button replies
-                        elif interactive.get("type") == "button_reply":
-                            button_reply = interactive.get("button_reply", {})
-                            button_id = button_reply.get("id", "")
-                            button_title = button_reply.get("title", "").strip()
-                            print(f"🔘 Button reply - ID: {button_id}, Title: {button_title}")
-                            
-                            if button_id:
-                                message_handler(button_id, sender, current_phone_id)
-                            elif button_title:
-                                message_handler(button_title, sender, current_phone_id)
+            if BACKGROUND_WORKERS:
+                with webhook_intake_lock:
+                    if not accepting_webhooks:
+                        # Shutting down: a non-2xx response makes Meta retry
+                        # the delivery, possibly on another worker
+                        return jsonify({"status": "unavailable"}), 503
+                    pieces = split_webhook(data)
+                    # Only this route adds to the shards, and only under the
+                    # lock, so checking for room first means either every
+                    # piece is queued or none is and Meta redelivers them all.
+                    # Handling a piece here would race the shard's worker on
+                    # the same sender.
+                    needed = {}
+                    for shard, _ in pieces:
+                        needed[shard] = needed.get(shard, 0) + 1
+                    if any(shard.qsize() + count > shard.maxsize for shard, count in needed.items()):
+                        logging.error("Webhook queue is full, asking Meta to retry")
+                        return jsonify({"status": "unavailable"}), 503
+                    for shard, piece in pieces:
+                        shard.put_nowait(piece)
+                    return jsonify({"status": "ok"}), 200
+
+            process_webhook(data)
 
         except Exception as e:
-            logging.error(f"❌ Webhook processing error: {str(e)}\n{traceback.format_exc()}")
+            logging.exception("❌ Webhook processing error")
             return jsonify({"status": "error", "message": str(e)}), 500
 
         return jsonify({"status": "ok"}), 200
 
 if __name__ == "__main__":
-    app.run(debug=True, port=8000)
+    app.run(port=int(os.environ.get("PORT", 8000)), threaded=True)